@@ -1,207 +1,456 @@
-import random
-import time
-import os
-import glob
-from collections import defaultdict
-import itertools
-
-from subgraphChecks import checkSubgraphConstraints
-
-
-def get_perfect_matchings(edge_list):
-    def get_edges_of_vertices(edge_list, vertices):
-        return [edge for edge in edge_list if set(edge[:2]).issubset(vertices)]
-
-    matchings_set = set()
-
-    for edge1 in edge_list:
-        subgraph1 = get_edges_of_vertices(edge_list, set(range(6)) - set(edge1[:2]))
-        for edge2 in subgraph1:
-            subgraph2 = get_edges_of_vertices(subgraph1, set(range(6)) - set(edge1[:2]) - set(edge2[:2]))
-            for edge3 in subgraph2:
-                # Sorting the edges to avoid permutations being considered as separate matchings
-                matching = tuple(sorted([edge1, edge2, tuple(edge3)]))
-                matchings_set.add(matching)
-
-    return [list(matching) for matching in matchings_set]
-
-
-def get_ivc(perfect_matching):
-    vertex_colors = [None] * 6
-    for edge in perfect_matching:
-        idxA, idxB, colA, colB = edge
-        vertex_colors[idxA] = colA
-        vertex_colors[idxB] = colB
-    return vertex_colors
-
-
-def count_ivc(perfect_matchings):
-    # Initialize the counts to 0 for all possible IVCs
-    all_possible_ivcs = defaultdict(int)
-    for ivc in itertools.product(range(3), repeat=6):
-        all_possible_ivcs[ivc] = 0
-
-    # Count the IVCs in the given perfect matchings
-    for pm in perfect_matchings:
-        ivc = tuple(get_ivc(pm))
-        all_possible_ivcs[ivc] += 1
-
-    return all_possible_ivcs
-
-
-def ivc_conditions(edges):
-    # None non-monochromatic IVC can exist only once.
-    # Monochromatic IVCs must exist at least once
-
-    # True: Fulfulls condition
-    # False: cannot be a counter-example
-    perfect_matchings = get_perfect_matchings(edges)
-    result = count_ivc(perfect_matchings)
-    for ivc, count in result.items():
-        #print(f"IVC {ivc} appears {count} times.")
-
-        if len(set(ivc))==1:
-            # monochromatic IVC needs to exist at least once:
-            if count==0:
-                #print(f"Monochromatic IVC with color={ivc[0]} doesnt exist.")
-                return False
-        else:
-            # non-monochromatic IVC cannot exist exactly once:
-            if count==1:
-                #print(f"Non-Monochromatic IVC with color={ivc} exist exactly once.")
-                return False
-
-    return True
-
-
-def checkGraph(vertices, colors, edges):
-    if not ivc_conditions(edges):
-        return False
-    return checkSubgraphConstraints(vertices, colors, edges)
-
-
-def randomGraph(full_edge_set, edge_probability):
-    edges = set()
-    for edge in full_edge_set:
-        if random.random() < edge_probability:
-            edges.add(edge)
-    return edges
-
-def randomAddEdges(edges, n, full_edge_set):
-    # Note: modifies edges set in place
-    missing_edges = full_edge_set - edges
-    if len(missing_edges) < n:
-        edges.update(missing_edges)
-    else:
-        subset = random.sample(list(missing_edges), n)
-        edges.update(subset)
-
-def randomRemoveEdges(edges, n):
-    # Note: modifies edges set in place
-    if len(edges) < n:
-        edges = set()
-    else:
-        subset = random.sample(list(edges), n)
-        edges.difference_update(subset)
-
-
-directory="results"
-if not os.path.exists(directory):
-    os.makedirs(directory)
-
-
-while True:
-    vertices = list(range(6))
-    colors = list(range(3))
-
-    all_edges = set()
-    for n1,n2 in itertools.combinations(vertices, 2):
-        for c1,c2 in itertools.product(colors, repeat=2):
-            all_edges.add((n1,n2,c1,c2))
-
-    CURR_ID=random.randint(10000000, 99999999)
-
-    all_min_graphs=[]
-
-    min_graph=[]
-    min_graph_len=666
-
-    while True:
-
-        # first try to randomly generate a graph that passes all the checks
-        attempts = 1
-        edges = randomGraph(all_edges, 0.5)
-        while not checkGraph(vertices, colors, edges):
-            attempts +=1
-            if attempts % 100 == 0:
-                print(f"... {attempts} attempts")
-            if random.random() < 0.0001:
-                print("Start completely from scratch")
-                edges = randomGraph(all_edges, 0.5)
-            elif random.random() < 0.5:
-                randomAddEdges(edges, random.randint(1,5), all_edges)
-            else:
-                randomRemoveEdges(edges, random.randint(1,5))
-        print(f"Found a graph in {attempts} attempts")
-
-        # -- previously, sometimes start from a known good graph?
-        # turn that off for now
-        """
-        else:
-            if random.random()>0.2:
-                edges=min_graph[:]
-            else:
-                edges=random.choice(all_min_graphs)[:]
-
-        res=True
-        if min_graph_len!=666 and checkGraph(vertices, colors, edges) == False:
-            print("MISTAKE")
-            for _ in range(10):
-                time.sleep(1)
-        """
-
-        # try to randomly minimize the graph
-        while True:
-
-            if len(edges)<min_graph_len:
-                min_graph = list(edges)
-                min_graph_len=len(edges)
-                #print(min_graph)
-                #print(f'Current minimum length: {min_graph_len}')
-
-                path = os.path.join("results", f"solution{len(min_graph)}_{CURR_ID}.txt")
-                did_write=False
-                while not did_write:
-                    try:
-                        with open(path, 'w') as file:
-                            file.write(f"{min_graph}")
-                        pattern = os.path.join(directory, f"solution*_{CURR_ID}.txt")
-
-                        # Get a list of matching filenames
-                        files_to_check = glob.glob(pattern)
-
-                        for file in files_to_check:
-                            # Extract the XXX number from the filename
-                            number = int(file.split("solution")[1].split("_")[0])
-
-                            # Check if it's not the length of min_graph
-                            if number != len(min_graph):
-                                os.remove(file)
-
-                        did_write=True
-                    except:
-                        time.sleep(0.1)
-
-                all_min_graphs.append(min_graph)
-
-            else:
-                #print(f'    Current length: {len(edges)} (best: {min_graph_len})')
-                pass
-
-            num_elements=random.choice([1,2,3,4])
-            randomRemoveEdges(edges, num_elements)
-
-            res = checkGraph(vertices, colors, edges)
-            if not res:
-                break
-
+import ctypes
+import random
+import time
+import os
+import itertools
+import multiprocessing as mp
+from collections import OrderedDict
+
+from subgraphChecks import checkSubgraphConstraints, GraphState
+
+
+def encode_edge(edge):
+    # pack an edge (n1,n2,c1,c2) into a single 16-bit integer
+    n1, n2, c1, c2 = edge
+    return (n1 << 12) | (n2 << 8) | (c1 << 4) | c2
+
+
+def decode_edge(code):
+    return ((code >> 12) & 0xF, (code >> 8) & 0xF, (code >> 4) & 0xF, code & 0xF)
+
+
+def edge_vertex_mask(edge):
+    # 6-bit mask of the two vertices the edge touches
+    return (1 << edge[0]) | (1 << edge[1])
+
+
+def code_vertex_mask(code):
+    return (1 << (code >> 12)) | (1 << ((code >> 8) & 0xF))
+
+
+def count_vertex0_edges(vmasks):
+    # Every perfect matching uses exactly one edge on vertex 0. Edges are
+    # (n1,n2,...) with n1 < n2, so once sorted by code those form a prefix;
+    # taking the first edge from that prefix and the other two in ascending
+    # order yields each matching exactly once, with no sort+set dedup.
+    num_first = 0
+    while num_first < len(vmasks) and vmasks[num_first] & 1:
+        num_first += 1
+    return num_first
+
+
+# IVC histogram index of each edge code: c1*3^(5-n1) + c2*3^(5-n2)
+IVC_WEIGHTS = (243, 81, 27, 9, 3, 1)
+NUM_IVCS = 3 ** 6
+MONOCHROMATIC_IVCS = frozenset((0, 364, 728))
+IVC_OFFSET = {
+    encode_edge((n1, n2, c1, c2)): c1 * IVC_WEIGHTS[n1] + c2 * IVC_WEIGHTS[n2]
+    for n1, n2 in itertools.product(range(6), repeat=2)
+    for c1, c2 in itertools.product(range(3), repeat=2)
+}
+
+# The edge universe for |V|=6, |C|=3, built once. ALL_EDGES is in ascending
+# code order, so a graph can be held as a 135-bit int (bit i <-> ALL_EDGES[i])
+# whose set bits come out in sorted order.
+VERTICES = list(range(6))
+COLORS = list(range(3))
+ALL_EDGES = tuple(
+    (n1, n2, c1, c2)
+    for n1, n2 in itertools.combinations(VERTICES, 2)
+    for c1, c2 in itertools.product(COLORS, repeat=2)
+)
+NUM_EDGES = len(ALL_EDGES)
+ALL_CODES = tuple(encode_edge(edge) for edge in ALL_EDGES)
+ALL_VMASKS = tuple(edge_vertex_mask(edge) for edge in ALL_EDGES)
+EDGE_BIT = {edge: 1 << i for i, edge in enumerate(ALL_EDGES)}
+
+
+# bitset of the monochromatic edges of each color
+MONO_EDGE_BITS = tuple(
+    sum(EDGE_BIT[edge] for edge in ALL_EDGES if edge[2] == edge[3] == c) for c in COLORS
+)
+
+
+def edges_to_bits(edges):
+    present = 0
+    for edge in edges:
+        present |= EDGE_BIT[tuple(edge)]
+    return present
+
+
+def bits_to_edges(present):
+    return [edge for i, edge in enumerate(ALL_EDGES) if (present >> i) & 1]
+
+
+def get_perfect_matchings(edge_list):
+    # Returns every perfect matching as a tuple of three encoded edges.
+    edge_codes = sorted(encode_edge(edge) for edge in edge_list)
+    edge_vmasks = [code_vertex_mask(code) for code in edge_codes]
+    num_edges = len(edge_codes)
+    num_first = count_vertex0_edges(edge_vmasks)
+
+    matchings = []
+    for i in range(num_first):
+        # used: vertices covered by the edges picked so far
+        used = edge_vmasks[i]
+        for j in range(num_first, num_edges):
+            if (edge_vmasks[j] & used) != 0:
+                continue
+            used2 = used | edge_vmasks[j]
+            for k in range(j + 1, num_edges):
+                if (edge_vmasks[k] & used2) == 0:
+                    matchings.append((edge_codes[i], edge_codes[j], edge_codes[k]))
+
+    return matchings
+
+
+def count_ivc(edges):
+    # Flat histogram over all 3^6 IVCs, indexed by the base-3 value of the
+    # vertex colors (vertex 0 most significant), for inspecting a graph.
+    return ivc_histogram([encode_edge(edge) for edge in edges], [edge_vertex_mask(edge) for edge in edges])
+
+
+def ivc_histogram(edge_codes, vmasks):
+    # Every vertex is covered by exactly one edge of a perfect matching, so
+    # its histogram index is the sum of per-edge offsets. Each matching found
+    # just bumps its slot, so no matchings or vertex colorings are ever stored.
+
+    # offsets of the edges on each vertex pair, keyed by the pair's vertex mask
+    pair_offsets = {}
+    for code, vmask in zip(edge_codes, vmasks):
+        pair_offsets.setdefault(vmask, []).append(IVC_OFFSET[code])
+    pairs = list(pair_offsets)
+
+    # Matching order: every perfect matching has exactly one pair on each
+    # vertex, so branch on the vertex with the fewest pairs first, then on
+    # the free vertex with the fewest pairs left. The last pair is then fixed.
+    counts = [0] * NUM_IVCS
+    v1 = min_degree_vertex(pairs, 0x3F)
+    for m1 in pairs:
+        if not m1 & v1:
+            continue
+        rest1 = [m for m in pairs if not m & m1]
+        v2 = min_degree_vertex(rest1, 0x3F ^ m1)
+        for m2 in rest1:
+            if not m2 & v2:
+                continue
+            offsets3 = pair_offsets.get(0x3F ^ m1 ^ m2)
+            if offsets3 is None:
+                continue
+            for f1 in pair_offsets[m1]:
+                for f2 in pair_offsets[m2]:
+                    f12 = f1 + f2
+                    for f3 in offsets3:
+                        counts[f12 + f3] += 1
+    return counts
+
+
+def min_degree_vertex(pairs, free):
+    # bit of the vertex in free that is on the fewest of the given pairs
+    best = 0
+    best_degree = len(pairs) + 1
+    while free:
+        v = free & -free
+        free ^= v
+        degree = sum(1 for m in pairs if m & v)
+        if degree < best_degree:
+            best, best_degree = v, degree
+    return best
+
+
+def ivc_ok(edge_codes, vmasks):
+    # Fused get_perfect_matchings -> count_ivc -> condition check.
+    counts = ivc_histogram(edge_codes, vmasks)
+
+    # two scans done in C by list.count instead of a Python loop over 729 slots:
+    # monochromatic IVCs need to exist at least once, and no other IVC may
+    # exist exactly once, so the only count-1 slots allowed are monochromatic
+    mono_counts = [counts[ivc] for ivc in MONOCHROMATIC_IVCS]
+    if 0 in mono_counts:
+        return False
+    return counts.count(1) == mono_counts.count(1)
+
+
+# Optional compiled ivc_ok, see ivcKernel.c for how to build it.
+try:
+    _ivc_lib = ctypes.CDLL(os.path.join(os.path.dirname(os.path.abspath(__file__)), "ivcKernel.so"))
+    _ivc_lib.ivc_ok.argtypes = [ctypes.POINTER(ctypes.c_uint16), ctypes.POINTER(ctypes.c_uint8), ctypes.c_int]
+    _ivc_lib.ivc_ok.restype = ctypes.c_int
+except OSError:
+    _ivc_lib = None
+
+
+def ivc_ok_compiled(edge_codes, vmasks):
+    # same as ivc_ok, in ivcKernel.so
+    n = len(edge_codes)
+    result = _ivc_lib.ivc_ok((ctypes.c_uint16 * n)(*edge_codes), (ctypes.c_uint8 * n)(*vmasks), n)
+    if result < 0:
+        # edges the kernel's fixed-size tables do not fit
+        return ivc_ok(edge_codes, vmasks)
+    return result == 1
+
+
+IVC_KERNEL = ivc_ok if _ivc_lib is None else ivc_ok_compiled
+
+
+def ivc_conditions(edges):
+    # None non-monochromatic IVC can exist only once.
+    # Monochromatic IVCs must exist at least once
+
+    # True: Fulfulls condition
+    # False: cannot be a counter-example
+    # (use count_ivc(edges) to inspect the counts)
+    return ivc_conditions_bits(edges_to_bits(edges))
+
+
+def has_perfect_matching(present, used=0):
+    # whether the edges in bitset present cover the vertices not in used
+    # with a perfect matching; tries the edges on the lowest free vertex
+    if used == 0x3F:
+        return True
+    free = ~used & (used + 1)
+    bits = present
+    while bits:
+        bit = bits & -bits
+        bits ^= bit
+        vmask = ALL_VMASKS[bit.bit_length() - 1]
+        if (vmask & free) and not (vmask & used):
+            if has_perfect_matching(present, used | vmask):
+                return True
+    return False
+
+
+def ivc_conditions_bits(present):
+    # ivc_conditions for a graph given as a bitset over ALL_EDGES
+
+    # Early exit: the monochromatic IVC of color c only comes from perfect
+    # matchings made of monochromatic c edges. If those have none, the
+    # condition fails whatever the rest of the graph is, so skip the
+    # full enumeration.
+    for mono_bits in MONO_EDGE_BITS:
+        if not has_perfect_matching(present & mono_bits):
+            return False
+
+    edge_codes = []
+    vmasks = []
+    while present:
+        bit = present & -present
+        present ^= bit
+        i = bit.bit_length() - 1
+        edge_codes.append(ALL_CODES[i])
+        vmasks.append(ALL_VMASKS[i])
+    return IVC_KERNEL(edge_codes, vmasks)
+
+
+def _checkGraph(vertices, colors, edges, present):
+    if not ivc_conditions_bits(present):
+        return False
+    return checkSubgraphConstraints(vertices, colors, edges)
+
+
+# checkGraph is pure and the random add/remove moves keep revisiting recent
+# graphs, so results are kept in an LRU keyed by the edge bitset.
+# (functools.lru_cache would need the key as the argument, but on a miss we
+# want to check the live GraphState with its incrementally kept dicts.)
+CHECK_CACHE_SIZE = 1 << 18
+check_cache = OrderedDict()
+
+def checkGraph(vertices, colors, edges):
+    present = edges.present if isinstance(edges, SearchGraph) else edges_to_bits(edges)
+    key = (present, len(vertices), len(colors))
+    result = check_cache.get(key)
+    if result is not None:
+        check_cache.move_to_end(key)
+        return result
+
+    result = _checkGraph(vertices, colors, edges, present)
+    check_cache[key] = result
+    if len(check_cache) > CHECK_CACHE_SIZE:
+        check_cache.popitem(last=False)
+    return result
+
+
+class SearchGraph(GraphState):
+    # GraphState which also keeps its edges as a bitset over ALL_EDGES
+
+    def __init__(self, edges=()):
+        self.present = 0
+        super().__init__(edges)
+
+    def add(self, edge):
+        if not super().add(edge):
+            return False
+        self.present |= EDGE_BIT[tuple(edge)]
+        return True
+
+    def remove(self, edge):
+        if not super().remove(edge):
+            return False
+        self.present &= ~EDGE_BIT[tuple(edge)]
+        return True
+
+
+def randomGraph(edge_probability):
+    edges = SearchGraph()
+    for edge in ALL_EDGES:
+        if random.random() < edge_probability:
+            edges.add(edge)
+    return edges
+
+def randomAddEdges(edges, n):
+    # Note: modifies edges SearchGraph in place
+    if NUM_EDGES - len(edges) <= n:
+        for edge in ALL_EDGES:
+            edges.add(edge)
+        return
+    # rejection sampling on the zero bits: draws uniformly among the
+    # missing edges without building the set difference
+    added = 0
+    while added < n:
+        i = random.randrange(NUM_EDGES)
+        if not (edges.present >> i) & 1:
+            edges.add(ALL_EDGES[i])
+            added += 1
+
+def randomRemoveEdges(edges, n):
+    # Note: modifies edges SearchGraph in place
+    if len(edges) < n:
+        edges = set()
+    else:
+        for edge in edges.edges.sample(n):
+            edges.remove(edge)
+
+
+directory="results"
+
+
+def solution_path(graph_len, curr_id):
+    return os.path.join(directory, f"solution{graph_len}_{curr_id}.txt")
+
+
+def search_worker(seed, best_len_shared, lock):
+    # One independent search, as run by each worker process.
+    # best_len_shared: length of the best graph found by any worker, guarded by lock
+    random.seed(seed)
+
+    while True:
+        vertices = VERTICES
+        colors = COLORS
+
+        CURR_ID=random.randint(10000000, 99999999)
+        check_cache.clear()
+
+        # graphs are kept as edge bitsets (see SearchGraph), so storing a
+        # snapshot is just keeping a reference to an int
+        all_min_graphs=[]
+
+        min_graph=0
+        min_graph_len=666
+        prev_best_len=None  # length in the solution file kept for this run, if any
+
+        while True:
+
+            # first try to randomly generate a graph that passes all the checks
+            attempts = 1
+            edges = randomGraph(0.5)
+            while not checkGraph(vertices, colors, edges):
+                attempts +=1
+                if attempts % 100 == 0:
+                    print(f"... {attempts} attempts")
+                if random.random() < 0.0001:
+                    print("Start completely from scratch")
+                    edges = randomGraph(0.5)
+                elif random.random() < 0.5:
+                    randomAddEdges(edges, random.randint(1,5))
+                else:
+                    randomRemoveEdges(edges, random.randint(1,5))
+            print(f"Found a graph in {attempts} attempts")
+
+            # -- previously, sometimes start from a known good graph?
+            # turn that off for now
+            """
+            else:
+                if random.random()>0.2:
+                    edges=SearchGraph(bits_to_edges(min_graph))
+                else:
+                    edges=SearchGraph(bits_to_edges(random.choice(all_min_graphs)))
+
+            res=True
+            if min_graph_len!=666 and checkGraph(vertices, colors, edges) == False:
+                print("MISTAKE")
+                for _ in range(10):
+                    time.sleep(1)
+            """
+
+            # try to randomly minimize the graph
+            while True:
+
+                if len(edges)<min_graph_len:
+                    min_graph = edges.present
+                    min_graph_len=len(edges)
+                    #print(bits_to_edges(min_graph))
+                    #print(f'Current minimum length: {min_graph_len}')
+
+                    # only keep a file for this run while it is at least as
+                    # good as the best any worker has found
+                    with lock:
+                        is_best = min_graph_len <= best_len_shared.value
+                        if is_best:
+                            best_len_shared.value = min_graph_len
+                            path = solution_path(min_graph_len, CURR_ID)
+                        else:
+                            path = None
+
+                        did_write=False
+                        while not did_write:
+                            try:
+                                if path is not None:
+                                    with open(path, 'w') as file:
+                                        file.write(f"{bits_to_edges(min_graph)}")
+                                did_write=True
+                            except:
+                                time.sleep(0.1)
+
+                        # the previous file of this run is now stale
+                        if prev_best_len is not None and prev_best_len != min_graph_len:
+                            prev_path = solution_path(prev_best_len, CURR_ID)
+                            try:
+                                os.unlink(prev_path)
+                            except FileNotFoundError:
+                                pass
+                        prev_best_len = min_graph_len if is_best else None
+
+                    all_min_graphs.append(min_graph)
+
+                else:
+                    #print(f'    Current length: {len(edges)} (best: {min_graph_len})')
+                    pass
+
+                num_elements=random.choice([1,2,3,4])
+                randomRemoveEdges(edges, num_elements)
+
+                res = checkGraph(vertices, colors, edges)
+                if not res:
+                    break
+
+
+def main(num_workers=None):
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    # the restarts are independent, so run one search per core; the workers
+    # only talk to each other through best_len_shared on improvements
+    best_len_shared = mp.Value('i', 666)
+    lock = mp.Lock()
+    workers = [
+        mp.Process(target=search_worker, args=(random.getrandbits(64), best_len_shared, lock))
+        for _ in range(num_workers or os.cpu_count())
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+if __name__ == '__main__':
+    main()
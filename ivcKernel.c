@@ -0,0 +1,104 @@
+/*
+ * Compiled version of ivc_ok from checkCounterExample.py.
+ * checkCounterExample.py loads ivcKernel.so with ctypes if it has been built,
+ * and otherwise uses the Python version:
+ *
+ *     gcc -O3 -march=native -shared -fPIC -o ivcKernel.so ivcKernel.c
+ */
+#include <stdint.h>
+
+#define NUM_IVCS 729
+#define MAX_PAIR_EDGES 9
+
+static const int IVC_WEIGHTS[6] = {243, 81, 27, 9, 3, 1};
+
+/* IVC histogram offset of an edge code n1<<12 | n2<<8 | c1<<4 | c2 */
+static inline int ivc_offset(uint16_t code)
+{
+    return ((code >> 4) & 0xF) * IVC_WEIGHTS[code >> 12]
+         + (code & 0xF) * IVC_WEIGHTS[(code >> 8) & 0xF];
+}
+
+/* bit of the vertex in free that is on the fewest of the given pairs */
+static uint8_t min_degree_vertex(const uint8_t *pairs, int num_pairs, uint8_t free)
+{
+    uint8_t best = 0;
+    int best_degree = num_pairs + 1;
+    for (int v = 0; v < 6; v++) {
+        uint8_t bit = 1 << v;
+        if (!(free & bit))
+            continue;
+        int degree = 0;
+        for (int a = 0; a < num_pairs; a++)
+            degree += (pairs[a] & bit) != 0;
+        if (degree < best_degree) {
+            best = bit;
+            best_degree = degree;
+        }
+    }
+    return best;
+}
+
+/*
+ * codes: edge codes n1<<12 | n2<<8 | c1<<4 | c2, with n1 < n2 < 6 and colors < 3
+ * vmasks: the 6-bit vertex mask of each edge
+ *
+ * returns 1 if every monochromatic IVC appears at least once and no
+ * non-monochromatic IVC appears exactly once, 0 if not,
+ * -1 if the edges do not fit (a vertex pair with more than 9 edges)
+ */
+int ivc_ok(const uint16_t *codes, const uint8_t *vmasks, int n)
+{
+    uint16_t hist[NUM_IVCS] = {0};
+    /* offsets of the edges on each vertex pair, indexed by the pair's vertex mask */
+    int pair_count[64] = {0};
+    int pair_offsets[64][MAX_PAIR_EDGES];
+    uint8_t pairs[64];
+    int num_pairs = 0;
+
+    for (int i = 0; i < n; i++) {
+        uint8_t m = vmasks[i];
+        if (m >= 64 || pair_count[m] == MAX_PAIR_EDGES)
+            return -1;
+        if (pair_count[m] == 0)
+            pairs[num_pairs++] = m;
+        pair_offsets[m][pair_count[m]++] = ivc_offset(codes[i]);
+    }
+
+    /* matching order: branch on the vertex with the fewest pairs first, then
+     * on the free vertex with the fewest pairs left; the last pair is fixed */
+    uint8_t v1 = min_degree_vertex(pairs, num_pairs, 0x3F);
+    for (int a = 0; a < num_pairs; a++) {
+        uint8_t m1 = pairs[a];
+        if (!(m1 & v1))
+            continue;
+        uint8_t rest1[64];
+        int num_rest1 = 0;
+        for (int b = 0; b < num_pairs; b++)
+            if (!(pairs[b] & m1))
+                rest1[num_rest1++] = pairs[b];
+        uint8_t v2 = min_degree_vertex(rest1, num_rest1, 0x3F ^ m1);
+        for (int b = 0; b < num_rest1; b++) {
+            uint8_t m2 = rest1[b];
+            if (!(m2 & v2))
+                continue;
+            uint8_t m3 = 0x3F ^ m1 ^ m2;
+            for (int x = 0; x < pair_count[m1]; x++)
+                for (int y = 0; y < pair_count[m2]; y++) {
+                    int f12 = pair_offsets[m1][x] + pair_offsets[m2][y];
+                    for (int z = 0; z < pair_count[m3]; z++)
+                        hist[f12 + pair_offsets[m3][z]]++;
+                }
+        }
+    }
+
+    for (int f = 0; f < NUM_IVCS; f++) {
+        if (f == 0 || f == 364 || f == 728) {
+            if (hist[f] == 0)
+                return 0;
+        } else if (hist[f] == 1) {
+            return 0;
+        }
+    }
+    return 1;
+}
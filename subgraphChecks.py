@@ -1,7 +1,9 @@
 
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+import functools
 import itertools
 import logging
+import random
 
 
 def calcEdgesByVertex(edges):
@@ -16,18 +18,205 @@ def calcEdgesByVertex(edges):
     return d
 
 
+# A colored vertex (n, c) has index c*VERTEX_BITS + n. That is its bit in a
+# colored vertex mask, so shifting a mask right by c*VERTEX_BITS gives the
+# vertex mask for color c, and its slot in the flat cVertexPairs list.
+# Supports graphs with up to VERTEX_BITS vertices and MAX_COLORS colors.
+VERTEX_BITS = 16
+VERTEX_MASK = (1 << VERTEX_BITS) - 1
+MAX_COLORS = 8
+NUM_CVERTICES = MAX_COLORS * VERTEX_BITS
+
+
+def cVertexIndex(n, c):
+    return c * VERTEX_BITS + n
+
+
+def cVertexBit(n, c):
+    return 1 << (c * VERTEX_BITS + n)
+
+
+def colorVertices(cmask, c):
+    """
+    returns  vertex mask of the n such that (n, c) is set in colored vertex mask cmask
+    """
+    return (cmask >> (c * VERTEX_BITS)) & VERTEX_MASK
+
+
+def vertexMask(vertices):
+    mask = 0
+    for n in vertices:
+        mask |= 1 << n
+    return mask
+
+
+def foldColors(cmask, shifts):
+    """
+    returns  vertex mask of the n such that (n, c) is set in cmask for some
+    color c, given shifts = c*VERTEX_BITS of the colors to consider
+    """
+    v = 0
+    for shift in shifts:
+        v |= cmask >> shift
+    return v & VERTEX_MASK
+
+
+ColorSpec = namedtuple("ColorSpec", ["cVertices", "fullStar", "otherColors", "otherShifts",
+                                     "checkDegree", "checkStars", "conditionalOnly", "collapses"])
+
+
+@functools.lru_cache(maxsize=None)
+def colorSpec(vertices, colors):
+    """
+    everything the checks need which only depends on the vertices and colors
+    (given as tuples), worked out once instead of on every check:
+      cVertices        (cVertexIndex(n1, c1), n1, c1) for all colored vertices
+      fullStar         n1 -> vertex mask of all vertices except n1
+      otherColors      c1 -> tuple of the colors != c1
+      otherShifts      c1 -> c*VERTEX_BITS for the colors != c1, see foldColors
+      checkDegree      degreeConstraint applies, |colors| >= 3
+      checkStars       star subgraph checks apply, |colors| >= 2
+      conditionalOnly  only the conditionally forbidden stars apply, |colors| = 2
+      collapses        (fromColor, toColor) pairs to check with color collapsing
+
+    Edges are assumed to only use the given colors.
+    """
+    allVertices = vertexMask(vertices)
+    otherColors = {c1: tuple(c2 for c2 in colors if c2 != c1) for c1 in colors}
+    return ColorSpec(
+        cVertices=tuple((cVertexIndex(n1, c1), n1, c1) for c1 in colors for n1 in vertices),
+        fullStar={n1: allVertices & ~(1 << n1) for n1 in vertices},
+        otherColors=otherColors,
+        otherShifts={c1: tuple(c2 * VERTEX_BITS for c2 in otherColors[c1]) for c1 in colors},
+        checkDegree=len(colors) >= 3,
+        checkStars=len(colors) >= 2,
+        conditionalOnly=len(colors) == 2,
+        # with |colors|>3, it may be useful to do multiple rounds of this
+        # just try collapsing once
+        collapses=tuple(itertools.permutations(colors, 2)) if len(colors) >= 3 else (),
+    )
+
+
 def calcColoredVertexPairing(edges):
     """
-    returns  dict (n1, c1) -> set of (n2, c2) such that there is an edge [n1,n2,c1,c2]
+    returns  list cVertexIndex(n1, c1) -> colored vertex mask of (n2, c2) such that there is an edge [n1,n2,c1,c2]
     """
-    d = defaultdict(set)
+    d = [0] * NUM_CVERTICES
     for edge in edges:
         n1,n2,c1,c2 = edge
-        d[(n1,c1)].add((n2,c2))
-        d[(n2,c2)].add((n1,c1))
+        d[cVertexIndex(n1,c1)] |= cVertexBit(n2,c2)
+        d[cVertexIndex(n2,c2)] |= cVertexBit(n1,c1)
     return d
 
 
+class EdgeBag:
+    """
+    set of edges which also supports O(1) random sampling
+
+    items is a list of the edges, pos maps edge -> index in items.
+    removal swaps the last item into the freed slot.
+    """
+
+    def __init__(self, edges=()):
+        self.items = []
+        self.pos = {}
+        for edge in edges:
+            self.add(edge)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, edge):
+        return edge in self.pos
+
+    def add(self, edge):
+        if edge in self.pos:
+            return False
+        self.pos[edge] = len(self.items)
+        self.items.append(edge)
+        return True
+
+    def remove(self, edge):
+        i = self.pos.pop(edge, None)
+        if i is None:
+            return False
+        last = self.items.pop()
+        if i < len(self.items):
+            self.items[i] = last
+            self.pos[last] = i
+        return True
+
+    def sample(self, n):
+        """
+        returns n distinct random edges, without copying the bag into a list
+        """
+        return [self.items[i] for i in random.sample(range(len(self.items)), n)]
+
+
+class GraphState:
+    """
+    set of edges together with its calcEdgesByVertex / calcColoredVertexPairing
+    results, updated incrementally as edges are added and removed
+
+    iterating over a GraphState yields its edges
+    """
+
+    def __init__(self, edges=()):
+        self.edges = EdgeBag()
+        self.edgesByVertex = defaultdict(set)
+        self.cVertexPairs = [0] * NUM_CVERTICES
+        for edge in edges:
+            self.add(edge)
+
+    def __iter__(self):
+        return iter(self.edges)
+
+    def __len__(self):
+        return len(self.edges)
+
+    def __contains__(self, edge):
+        return edge in self.edges
+
+    def add(self, edge):
+        """
+        returns True if the edge was not in the graph yet
+        """
+        edge = tuple(edge)
+        if not self.edges.add(edge):
+            return False
+        n1,n2,c1,c2 = edge
+        self.edgesByVertex[n1].add(edge)
+        self.edgesByVertex[n2].add(edge)
+        self.cVertexPairs[cVertexIndex(n1,c1)] |= cVertexBit(n2,c2)
+        self.cVertexPairs[cVertexIndex(n2,c2)] |= cVertexBit(n1,c1)
+        return True
+
+    def remove(self, edge):
+        """
+        returns True if the edge was in the graph
+        """
+        edge = tuple(edge)
+        if not self.edges.remove(edge):
+            return False
+        n1,n2,c1,c2 = edge
+        self._discard(self.edgesByVertex, n1, edge)
+        self._discard(self.edgesByVertex, n2, edge)
+        self.cVertexPairs[cVertexIndex(n1,c1)] &= ~cVertexBit(n2,c2)
+        self.cVertexPairs[cVertexIndex(n2,c2)] &= ~cVertexBit(n1,c1)
+        return True
+
+    @staticmethod
+    def _discard(d, key, value):
+        # drop emptied entries, so the dict matches a from-scratch rebuild
+        entries = d[key]
+        entries.discard(value)
+        if not entries:
+            del d[key]
+
+
 def degreeConstraint(colors, edgesByVertex):
     """
     check constraint from Rishi's result
@@ -69,36 +258,34 @@ def forbiddenStarA(colors, vertices, cVertexPairs):
       implications of the form:
         if edges X are not in the graph, then edges Y cannot be in the graph either.
     """
-    if len(colors) < 2:
+    spec = colorSpec(tuple(vertices), tuple(colors))
+    if not spec.checkStars:
         return True
 
     # consider all possible n1,c1 for the center node of the star graph
-    for cnode, cnodes in cVertexPairs.items():
-        n1,c1 = cnode
+    # (cnodes is a colored vertex mask, see calcColoredVertexPairing)
+    for i1, n1, c1 in spec.cVertices:
+        cnodes = cVertexPairs[i1]
+        if not cnodes:
+            continue
 
         # first determine which vertices we need to consider for the star
-        checkVertices = set()
-        for n2 in vertices:
-            if n2 == n1:
-                continue
-            if (n2,c1) in cnodes:
-                checkVertices.add(n2)
+        checkVertices = colorVertices(cnodes, c1) & spec.fullStar[n1]
 
         # If there are no vertices to check, we have the degenerate case:
         #   the "empty set" is always a subset of the edges.
         # This should not happen though, because it means there was no
         # monochrome c1 edge incident on vertex n1.
-        if len(checkVertices) == 0:
+        if checkVertices == 0:
             return False
 
         # determine if star subgraph exists
-        vcolor = {} # vertex from V -> color
-        for n2,c2 in cnodes:
-            if (n2 in checkVertices) and (c2 != c1):
-                vcolor[n2] = c2
+        # vcolor: vertices from V which have a multi-color edge to n1
+        # (a subset of checkVertices, so the star exists iff they are equal)
+        vcolor = foldColors(cnodes, spec.otherShifts[c1]) & checkVertices
 
-        if len(vcolor) == len(checkVertices):
-            logging.debug(f"starA n1={n1}, c1={c1}, {vcolor}")
+        if vcolor == checkVertices:
+            logging.debug(f"starA n1={n1}, c1={c1}, V={checkVertices:b}")
             return False
     return True
 
@@ -129,46 +316,44 @@ def forbiddenStarB(colors, vertices, cVertexPairs):
     The real forbidden subgraphs only apply to |colors| >= 3.
     However the conditionally forbidden subgraphs still apply to |colors| = 2.
     """
-    if len(colors) < 2:
+    spec = colorSpec(tuple(vertices), tuple(colors))
+    if not spec.checkStars:
         return True
 
     # consider all possible n1,c1 for the center node of the star graph
-    for cnode, cnodes in cVertexPairs.items():
-        n1,c1 = cnode
+    # (cnodes is a colored vertex mask, see calcColoredVertexPairing)
+    for i1, n1, c1 in spec.cVertices:
+        cnodes = cVertexPairs[i1]
+        if not cnodes:
+            continue
+        fullStar = spec.fullStar[n1]
 
         # consider all c2, which is a color the star must avoid
         #   and also (along with c1) determines which edge colors require a vertex to be included
-        for c2 in colors:
-            if c1 == c2:
-                continue
+        for c2, shift2 in zip(spec.otherColors[c1], spec.otherShifts[c1]):
 
             # first determine which vertices we need to consider for the star
-            checkVertices = set()
-            for n2 in vertices:
-                if n2 == n1:
-                    continue
-                if ((n2,c2) in cnodes) or ((n2,c2) in cVertexPairs[(n1,c2)]):
-                    checkVertices.add(n2)
+            # (shift2 + n1 is cVertexIndex(n1, c2))
+            checkVertices = colorVertices(cnodes | cVertexPairs[shift2 + n1], c2) & fullStar
 
             # if |colors| = 2, only the conditionally forbidden subgraphs apply
-            if (len(colors) == 2) and (len(checkVertices) == len(vertices) - 1):
+            if spec.conditionalOnly and (checkVertices == fullStar):
                 continue
 
             # If there are no vertices to check, we have the degenerate case:
             #   the "empty set" is always a subset of the edges.
             # This should not happen though, because it means there was no
             # monochrome c2 edge incident on vertex n1.
-            if len(checkVertices) == 0:
+            if checkVertices == 0:
                 return False
 
             # determine if star subgraph exists
-            vcolor = {} # vertex from V -> color
-            for n3,c3 in cnodes:
-                if (n3 in checkVertices) and (c3 != c2):
-                    vcolor[n3] = c3
+            # vcolor: vertices from V which have an edge to n1 avoiding c2
+            # (a subset of checkVertices, so the star exists iff they are equal)
+            vcolor = foldColors(cnodes, spec.otherShifts[c2]) & checkVertices
 
-            if len(vcolor) == len(checkVertices):
-                logging.debug(f"starB n1={n1}, c1={c1}, {vcolor}")
+            if vcolor == checkVertices:
+                logging.debug(f"starB n1={n1}, c1={c1}, c2={c2}, V={checkVertices:b}")
                 return False
     return True
 
@@ -226,56 +411,53 @@ def forbiddenStarC(colors, vertices, cVertexPairs):
     The real forbidden subgraphs only apply to |colors| >= 3.
     However the conditionally forbidden subgraphs still apply to |colors| = 2.
     """
-    if len(colors) < 2:
+    spec = colorSpec(tuple(vertices), tuple(colors))
+    if not spec.checkStars:
         return True
 
     # consider all possible n1,c1 for the center node of the star graph
-    for cnode, cnodes in cVertexPairs.items():
-        n1,c1 = cnode
+    # (cnodes is a colored vertex mask, see calcColoredVertexPairing)
+    for i1, n1, c1 in spec.cVertices:
+        cnodes = cVertexPairs[i1]
+        if not cnodes:
+            continue
+        fullStar = spec.fullStar[n1]
+        otherShifts = spec.otherShifts[c1]
+
+        # vertices which have an edge to n1 not ending in color c1
+        others = foldColors(cnodes, otherShifts)
 
         # consider all c2, which is the 'alternate' color of the star central node
         #   and also (along with c1) determines which edge colors require a vertex to be included
-        for c2 in colors:
-            if c1 == c2:
-                continue
+        for c2, shift2 in zip(spec.otherColors[c1], otherShifts):
+            altNodes = cVertexPairs[shift2 + n1]
 
             # first determine which vertices we need to consider for the star
-            checkVertices = set()
-            for n2 in vertices:
-                if n2 == n1:
-                    continue
-                if ((n2,c1) in cnodes) or ((n2,c1) in cVertexPairs[(n1,c2)]):
-                    checkVertices.add(n2)
+            checkVertices = colorVertices(cnodes | altNodes, c1) & fullStar
 
             # if |colors| = 2, only the conditionally forbidden subgraphs apply
-            if (len(colors) == 2) and (len(checkVertices) == len(vertices) - 1):
+            if spec.conditionalOnly and (checkVertices == fullStar):
                 continue
 
             # If there are no vertices to check, we have the degenerate case:
             #   the "empty set" is always a subset of the edges.
             # This should not happen though, because it means there was no
             # monochrome c1 edge incident on vertex n1.
-            if len(checkVertices) == 0:
+            if checkVertices == 0:
                 return False
 
             # consider all n2, the edge which disagrees on the color of n1 in the star
-            for n2,c3 in cVertexPairs[(n1,c2)]:
-                if c3 == c1:
-                    continue
-                if n2 not in checkVertices:
-                    continue
+            candidates = foldColors(altNodes, otherShifts) & checkVertices
+
+            while candidates:
+                n2bit = candidates & -candidates
+                candidates ^= n2bit
 
                 # determine if star subgraph exists
-                vcolor = {} # vertex from V -> color
-                vcolor[n2] = c3
-                for n3,c4 in cnodes:
-                    if n3 == n2:
-                        continue
-                    if (n3 in checkVertices) and (c4 != c1):
-                        vcolor[n3] = c4
-
-                if len(vcolor) == len(checkVertices):
-                    logging.debug(f"starC n1={n1}, c1={c1}, n2={n2}, {vcolor}")
+                vcolor = (others & checkVertices) | n2bit
+
+                if vcolor == checkVertices:
+                    logging.debug(f"starC n1={n1}, c1={c1}, c2={c2}, n2={n2bit.bit_length() - 1}, V={checkVertices:b}")
                     return False
     return True
 
@@ -305,14 +487,25 @@ def _checkSubgraphConstraints(vertices, colors, edges):
     Checks subgraph constraints for monochromatic graph
     Does not perform color collapse checks.
 
+    edges may be a GraphState, in which case its lookups are used as is
+
     returns True is all tests pass, else False
     """
-    edgesByVertex = calcEdgesByVertex(edges)
-    cVertexPairs = calcColoredVertexPairing(edges)
+    if isinstance(edges, GraphState):
+        edgesByVertex = edges.edgesByVertex
+        cVertexPairs = edges.cVertexPairs
+    else:
+        edgesByVertex = calcEdgesByVertex(edges)
+        cVertexPairs = calcColoredVertexPairing(edges)
+
+    spec = colorSpec(tuple(vertices), tuple(colors))
 
-    if not degreeConstraint(colors, edgesByVertex):
+    if spec.checkDegree and not degreeConstraint(colors, edgesByVertex):
         return False
 
+    if not spec.checkStars:
+        return True
+
     if not forbiddenStarA(colors, vertices, cVertexPairs):
         return False
 
@@ -325,6 +518,16 @@ def _checkSubgraphConstraints(vertices, colors, edges):
     return True
 
 
+@functools.lru_cache(maxsize=1 << 14)
+def _checkCollapsedConstraints(vertices, colors, edges):
+    """
+    _checkSubgraphConstraints memoized for the color collapsed graphs,
+    which often coincide for different graphs during a search.
+    vertices, colors are tuples and edges a frozenset
+    """
+    return _checkSubgraphConstraints(vertices, colors, edges)
+
+
 def checkSubgraphConstraints(vertices, colors, edges):
     """
     Checks subgraph constraints for monochromatic graph
@@ -335,15 +538,25 @@ def checkSubgraphConstraints(vertices, colors, edges):
     if not _checkSubgraphConstraints(vertices, colors, edges):
         return False
 
-    # also check with color collapsing
-    # with |colors|>3, it may be useful to do multiple rounds of this
-    # just try collapsing once
-    if len(colors) >= 3:
-        for fromColor, toColor in itertools.permutations(colors, 2):
-            newEdges, newColors = colorCollapse(colors, fromColor, toColor, edges)
-            if not _checkSubgraphConstraints(vertices, newColors, newEdges):
-                logging.debug(f"Failed check with color collapsing {fromColor} -> {toColor}")
-                return False
+    # also check with color collapsing (see colorSpec for which collapses)
+    collapses = colorSpec(tuple(vertices), tuple(colors)).collapses
+    if not collapses:
+        return True
+
+    usedColors = set()
+    for n1,n2,c1,c2 in edges:
+        usedColors.add(c1)
+        usedColors.add(c2)
+
+    for fromColor, toColor in collapses:
+        # collapsing a color that no edge uses leaves the edges unchanged,
+        # and the same edges with fewer colors pass whenever they passed above
+        if fromColor not in usedColors:
+            continue
+        newEdges, newColors = colorCollapse(colors, fromColor, toColor, edges)
+        if not _checkCollapsedConstraints(tuple(vertices), tuple(newColors), frozenset(newEdges)):
+            logging.debug(f"Failed check with color collapsing {fromColor} -> {toColor}")
+            return False
 
     return True
 